@@ -2,9 +2,15 @@
 AIA G703 Pay App Checker — Excel/CSV Only, Batch Upload (All Formats)
 """
 
+import io
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+
 import streamlit as st
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+import numpy as np
 import pandas as pd
-import openai
 
 st.title("AIA G703 Pay App Checker — Batch Upload")
 st.write(
@@ -14,13 +20,42 @@ st.write(
 )
 
 # ---------------------
-# OpenAI API key
+# OpenAI client
 # ---------------------
 try:
-    openai.api_key = st.secrets["OPENAI_API_KEY"]
+    OPENAI_API_KEY = st.secrets["OPENAI_API_KEY"]
 except KeyError:
+    OPENAI_API_KEY = None
     st.warning("OpenAI API key not found! Please add OPENAI_API_KEY in Streamlit Secrets.")
 
+# Fixed instructions go in the system message; only the mismatch list varies
+SYSTEM_INSTRUCTIONS = (
+    "You review AIA G703 pay applications. Each mismatch pairs a previous pay app "
+    "whose 'Total Completed and Stored to Date' should equal 'Previous Applications' "
+    "on the current pay app. Explain possible reasons for mismatches and recommendations."
+)
+
+@st.cache_resource(show_spinner=False)
+def get_openai_client(api_key):
+    # Imported on first use so cold starts without mismatches skip loading openai;
+    # the client (and its connection pool) is then shared across reruns
+    from openai import OpenAI
+    return OpenAI(api_key=api_key)
+
+@st.cache_data(show_spinner=False)
+def summarize_mismatches(_client, ai_input):
+    # Keyed on the prompt text only, so reruns with the same mismatches reuse
+    # the earlier answer instead of calling (and billing) the API again
+    response = _client.chat.completions.create(
+        model="gpt-3.5-turbo",
+        messages=[
+            {"role": "system", "content": SYSTEM_INSTRUCTIONS},
+            {"role": "user", "content": ai_input},
+        ],
+        max_tokens=300
+    )
+    return response.choices[0].message.content
+
 # ---------------------
 # File uploads
 # ---------------------
@@ -38,82 +73,150 @@ curr_files = st.file_uploader(
 # ---------------------
 # Universal parser
 # ---------------------
-def parse_file(file, prev_column=None, completed_column=None):
+# Currency formatting stripped from text amounts ("$1,234.56")
+_CURRENCY_RE = re.compile(r"[,$\s]")
+# Accounting-style negatives ("(1234.56)" once stripped) become "-1234.56"
+_ACCOUNTING_NEGATIVE_RE = re.compile(r"^\((.*)\)$")
+# Accounting-style zeros (" $ -   " once stripped) are a lone dash
+_ACCOUNTING_ZERO_RE = re.compile(r"^[-–—]$")
+
+# Previous files are checked on "Total Completed and Stored to Date", current
+# files on "Previous Applications"; every file is read once for both
+COMPLETED_COLUMN = "Total Completed and Stored to Date"
+PREVIOUS_COLUMN = "Previous Applications"
+G703_COLUMNS = (COMPLETED_COLUMN, PREVIOUS_COLUMN)
+
+def _column_total(series):
+    # Returns the column total and how many non-blank cells could not be read
+    # as numbers (left out of the total, so the caller can warn about them)
+    if pd.api.types.is_numeric_dtype(series):
+        return float(np.nansum(series.to_numpy(dtype=np.float64, na_value=np.nan))), 0
+    text = (
+        series.astype("string")
+        .str.replace(_CURRENCY_RE, "", regex=True)
+        .str.replace(_ACCOUNTING_NEGATIVE_RE, r"-\1", regex=True)
+        .str.replace(_ACCOUNTING_ZERO_RE, "0", regex=True)
+    )
+    numbers = pd.to_numeric(text, errors="coerce")
+    unparsed = int((text.fillna("").ne("") & numbers.isna()).sum())
+    return float(np.nansum(numbers.to_numpy(dtype=np.float64, na_value=np.nan))), unparsed
+
+def _sum_frame_columns(df, columns):
+    # Sum each requested column that is present; absent ones are left out so
+    # the caller can report them only for the role that needs them
+    return {column: _column_total(df[column]) for column in columns if column in df.columns}
+
+def _sum_csv_columns(buf, columns):
+    # Only materialize the columns being summed
+    return _sum_frame_columns(pd.read_csv(buf, usecols=lambda c: c in columns), columns)
+
+def _sum_excel_columns(buf, columns):
+    # calamine (Rust) reads both .xls and .xlsx, returning cached formula values
+    return _sum_frame_columns(pd.read_excel(buf, engine="calamine", usecols=lambda c: c in columns), columns)
+
+_READERS = {
+    ".csv": _sum_csv_columns,
+    ".xls": _sum_excel_columns,
+    ".xlsx": _sum_excel_columns,
+}
+
+@st.cache_data(show_spinner=False)
+def _parse_file_bytes(data, name):
+    # Keyed on the raw upload bytes, so reruns with the same files skip parsing
+    reader = _READERS.get(os.path.splitext(name)[1].lower(), _sum_excel_columns)
+    return reader(io.BytesIO(data), G703_COLUMNS)
+
+def submit_parse(executor, pending, file):
+    # A file appearing as both a current and a previous pay app (chained
+    # batches) shares one job
+    data = file.getvalue()
+    key = (data, file.name)
+    if key not in pending:
+        pending[key] = executor.submit(_parse_file_bytes, data, file.name)
+    return pending[key]
+
+def parse_result(file, future, column):
     try:
-        if file.name.endswith(".csv"):
-            df = pd.read_csv(file)
-        elif file.name.endswith(".xls"):
-            df = pd.read_excel(file, engine="xlrd")
-        else:  # xlsx
-            df = pd.read_excel(file, engine="openpyxl")
-        
-        # If column names are provided, use them; otherwise defaults
-        if prev_column and prev_column not in df.columns:
-            st.error(f"{file.name} missing required column: {prev_column}")
-            return None, None
-        if completed_column and completed_column not in df.columns:
-            st.error(f"{file.name} missing required column: {completed_column}")
-            return None, None
-        
-        prev_total = df[prev_column].sum() if prev_column else None
-        completed_total = df[completed_column].sum() if completed_column else None
-        return prev_total, completed_total
+        totals = future.result()
     except Exception as e:
         st.error(f"Error parsing {file.name}: {e}")
-        return None, None
+        return None
+    if column not in totals:
+        st.error(f"{file.name} missing required column: {column}")
+        return None
+    total, unparsed = totals[column]
+    if unparsed:
+        st.warning(f"{file.name}: {unparsed} non-numeric cell(s) in '{column}' were left out of the total")
+    return total
 
 # ---------------------
 # Process all files
 # ---------------------
-results = []
+results = pd.DataFrame()
 
 if prev_files and curr_files:
     # Ensure same number of previous and current files
     if len(prev_files) != len(curr_files):
         st.warning("Number of previous and current files must match for comparison.")
     else:
-        for prev_file, curr_file in zip(prev_files, curr_files):
+        # Parse every file concurrently; pool threads share this run's context
+        # so the cached parser behaves as it does on the script thread
+        jobs = []
+        pending = {}
+        with ThreadPoolExecutor(
+            max_workers=min(8, 2 * len(prev_files)),
+            initializer=add_script_run_ctx,
+            initargs=(None, get_script_run_ctx()),
+        ) as executor:
+            for prev_file, curr_file in zip(prev_files, curr_files):
+                prev_job = submit_parse(executor, pending, prev_file)
+                curr_job = submit_parse(executor, pending, curr_file)
+                jobs.append((prev_file, curr_file, prev_job, curr_job))
+
+        # Collect columns and build the results frame once
+        prev_names, curr_names, prev_totals, curr_totals = [], [], [], []
+        for prev_file, curr_file, prev_job, curr_job in jobs:
             # Previous file uses "Total Completed and Stored to Date"
-            _, prev_total = parse_file(prev_file, completed_column="Total Completed and Stored to Date")
+            prev_total = parse_result(prev_file, prev_job, COMPLETED_COLUMN)
             # Current file uses "Previous Applications"
-            curr_prev_total, _ = parse_file(curr_file, prev_column="Previous Applications")
+            curr_prev_total = parse_result(curr_file, curr_job, PREVIOUS_COLUMN)
 
             if prev_total is not None and curr_prev_total is not None:
-                match = abs(prev_total - curr_prev_total) < 0.01
-                results.append({
-                    "Previous File": prev_file.name,
-                    "Current File": curr_file.name,
-                    "Total Completed and Stored to Date (Prev)": prev_total,
-                    "Previous Applications (Curr)": curr_prev_total,
-                    "Match": "✅" if match else "❌"
-                })
+                prev_names.append(prev_file.name)
+                curr_names.append(curr_file.name)
+                prev_totals.append(prev_total)
+                curr_totals.append(curr_prev_total)
+
+        prev_totals = np.asarray(prev_totals, dtype=np.float64)
+        curr_totals = np.asarray(curr_totals, dtype=np.float64)
+        # Compare all pairs in one pass, to the cent
+        matches = np.isclose(prev_totals, curr_totals, rtol=0, atol=0.01)
+        results = pd.DataFrame({
+            "Previous File": prev_names,
+            "Current File": curr_names,
+            "Total Completed and Stored to Date (Prev)": prev_totals,
+            "Previous Applications (Curr)": curr_totals,
+            "Match": np.where(matches, "✅", "❌"),
+        })
 
 # ---------------------
 # Display results
 # ---------------------
-if results:
-    df_results = pd.DataFrame(results)
-    # Format numbers
-    df_results["Total Completed and Stored to Date (Prev)"] = df_results["Total Completed and Stored to Date (Prev)"].map(lambda x: f"{x:,.2f}")
-    df_results["Previous Applications (Curr)"] = df_results["Previous Applications (Curr)"].map(lambda x: f"{x:,.2f}")
-    st.dataframe(df_results)
+if not results.empty:
+    # Format numbers for display only; the underlying columns stay float
+    st.dataframe(results.style.format({
+        "Total Completed and Stored to Date (Prev)": "{:,.2f}",
+        "Previous Applications (Curr)": "{:,.2f}",
+    }))
 
     # Optional AI summary for mismatches
-    mismatches = [r for r in results if r["Match"] == "❌"]
-    if mismatches:
+    mismatches = results[results["Match"] == "❌"]
+    if not mismatches.empty and OPENAI_API_KEY:
         try:
-            ai_input = "Review the following G703 pay apps mismatches:\n"
-            for m in mismatches:
-                ai_input += f"{m['Previous File']} vs {m['Current File']}: Prev Total = {m['Total Completed and Stored to Date (Prev)']}, Curr Previous = {m['Previous Applications (Curr)']}\n"
-            ai_input += "Explain possible reasons for mismatches and recommendations."
-
-            response = openai.chat.completions.create(
-                model="gpt-3.5-turbo",
-                messages=[{"role": "user", "content": ai_input}],
-                max_tokens=300
-            )
+            ai_input = "Review the following G703 pay apps mismatches:\n" + mismatches.drop(columns="Match").to_csv(index=False, float_format="%.2f")
+            summary = summarize_mismatches(get_openai_client(OPENAI_API_KEY), ai_input)
             st.markdown("### AI Summary for Mismatches")
-            st.write(response.choices[0].message.content)
+            st.write(summary)
         except Exception as e:
             st.error(f"Error generating AI summary: {e}")
 else: